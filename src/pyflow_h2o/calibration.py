@@ -0,0 +1,114 @@
+''' pipe roughness calibration against observed pressures
+
+Pipes are grouped (by material, size, ...) and each group gets one multiplier on f,
+fitted by Levenberg-Marquardt so solved pressures match the observed ones. The
+formula exponent n_exp is left as entered.
+
+Sensitivities come from the solver's last factorized system instead of one finite
+difference solve per group. At a solution A11(Q) Q + A12 H + A10 H0 = 0 and
+A21 Q = -q, so for log multipliers t
+
+    S dH/dt = -A21 D^-1 G,    G[p, g] = a_p h_p for pipes p in group g
+
+with S = A21 D^-1 A12 already factorized and h_p the head loss in pipe p. All
+groups share one solve with a multi column right hand side.
+'''
+
+import csv
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def read_observations(filepath):
+    ''' reads node id, pressure head pairs from a csv file, a header row is skipped '''
+    observations = {}
+    with open(filepath, newline='') as f:
+        for row in csv.reader(f):
+            try:
+                observations[int(row[0])] = float(row[1])
+            except (ValueError, IndexError):
+                continue
+    return observations
+
+
+class Calibration:
+    def __init__(self, network, observations, groups):
+        ''' observations maps node id to pressure head, groups holds a group label per pipe '''
+        self.network = network
+
+        index = {node_id: i for i, node_id in enumerate(network.node_ids.tolist())}
+        missing = [node_id for node_id in observations if node_id not in index]
+        if missing:
+            raise ValueError(f'Observed nodes are not in the network: {missing}')
+
+        # rows of the solved heads, fixed head nodes do not respond to roughness
+        row = np.full(len(network.node_ids), -1)
+        row[network.unknown_nodes] = np.arange(len(network.unknown_nodes))
+        observed = [(row[index[node_id]], pressure) for node_id, pressure in observations.items()
+                    if row[index[node_id]] >= 0]
+        if not observed:
+            raise ValueError('No observations at nodes with an unknown head.')
+        self.rows = np.array([o[0] for o in observed])
+        self.observed = np.array([o[1] for o in observed])
+
+        self.labels, group = np.unique(np.asarray(groups, dtype=str), return_inverse=True)
+        self.group = sp.csr_matrix((np.ones(len(group)), (np.arange(len(group)), group)),
+                                   shape=(len(group), len(self.labels)))
+        self.a = network.friction_exponent()
+
+    def evaluate(self, t, flow=None):
+        ''' solves with group log multipliers t, returns (residuals, solution, f) '''
+        f = self.network.f * np.exp(self.group @ t)
+        solution = self.network.solve(r=self.network.resistance(f=f), flow=flow)
+        residual = solution.head[self.network.unknown_nodes][self.rows] - self.observed
+        return residual, solution, f
+
+    def jacobian(self, solution, f):
+        ''' d(observed heads)/dt from the factorized system of the solution '''
+        r = self.network.resistance(f=f)
+        q = solution.flow
+        loss = r * q * np.abs(q) ** (self.network.n_exp - 1)
+        G = sp.diags(self.a * loss) @ self.group
+        rhs = -(self.network.A21 @ sp.diags(solution.dinv) @ G).toarray()
+        dH = solution.factor.solve(rhs)
+        return dH[self.rows]
+
+    def run(self, max_iter=30, tol=1e-8):
+        ''' fits the group multipliers, returns (f per pipe, rms before, rms after) '''
+        t = np.zeros(len(self.labels))
+        residual, solution, f = self.evaluate(t)
+        cost = residual @ residual
+        rms_before = np.sqrt(cost / len(residual))
+        damping = 1e-3
+
+        for iteration in range(max_iter):
+            J = self.jacobian(solution, f)
+            JtJ = J.T @ J
+            gradient = J.T @ residual
+            scale = np.diag(JtJ) + 1e-12 * max(JtJ.max(), 1e-12)
+
+            # damp until a step lowers the misfit
+            while damping < 1e10:
+                step = np.linalg.solve(JtJ + damping * np.diag(scale), -gradient)
+                try:
+                    trial = self.evaluate(t + step, flow=solution.flow)
+                except ValueError:
+                    damping *= 10
+                    continue
+                trial_cost = trial[0] @ trial[0]
+                if trial_cost < cost:
+                    break
+                damping *= 10
+            else:
+                break
+
+            t = t + step
+            residual, solution, f = trial
+            improvement = cost - trial_cost
+            cost = trial_cost
+            damping = max(damping / 10, 1e-9)
+            if improvement <= tol * max(cost, tol):
+                break
+
+        return f, rms_before, np.sqrt(cost / len(residual))
@@ -0,0 +1,194 @@
+''' pipe size optimization
+
+Genetic search over a diameter catalogue for the cheapest design that keeps every
+solved node above a minimum pressure, followed by a greedy pass that steps single
+pipes down the catalogue while the design stays feasible. The greedy pass runs
+at most REFINE_ROUNDS rounds and tries the steps with the largest savings first,
+so it does not grow with the square of the number of pipes.
+
+Candidates are ranked by (pressure violation, cost), so any feasible design beats
+any infeasible one. Each generation is evaluated as a batch across worker processes
+that receive the base network once at start up. Batches are sorted so that similar
+candidates land on the same worker, which warm starts each solve from the flows of
+the candidate it solved before.
+
+run() blocks, so the app calls it from a background thread and can stop it with
+cancel() - checked at each generation and batch, and while a batch is evaluated.
+'''
+
+import multiprocessing
+import os
+import random
+import threading
+
+import numpy as np
+
+# (nominal diameter mm, internal diameter m, cost per m)
+CATALOGUE = [
+            (100, 0.108, 60.0),
+            (150, 0.155, 85.0),
+            (200, 0.204, 115.0),
+            (250, 0.250, 150.0),
+            (300, 0.300, 190.0),
+            (375, 0.375, 255.0),
+            (450, 0.450, 330.0),
+            (600, 0.600, 490.0)
+            ]
+
+REFINE_ROUNDS = 50 # most rounds of the greedy pass
+REFINE_WIDTH = 16 # single pipe steps tried per round, at least 4 per worker
+
+# worker process state, set once by _init_worker
+_network = None
+_diameters = None
+_min_pressure = None
+_warm_flow = None
+
+
+def _init_worker(network, diameters, min_pressure):
+    global _network, _diameters, _min_pressure, _warm_flow
+    _network = network
+    _diameters = diameters
+    _min_pressure = min_pressure
+    _warm_flow = None
+
+
+def _evaluate(sizes):
+    ''' pressure violation of one candidate, sizes are catalogue indexes per pipe '''
+    global _warm_flow
+    r = _network.resistance(diameter=_diameters[np.asarray(sizes)])
+    try:
+        solution = _network.solve(r=r, flow=_warm_flow)
+    except ValueError:
+        # flows of a very different candidate can be a poor start, retry from cold
+        _warm_flow = None
+        try:
+            solution = _network.solve(r=r)
+        except ValueError:
+            return float('inf')
+    _warm_flow = solution.flow
+
+    pressure = solution.head[_network.unknown_nodes]
+    return float(np.maximum(_min_pressure - pressure, 0).sum())
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Optimizer:
+    def __init__(self, network, min_pressure, catalogue=CATALOGUE, workers=None, seed=None):
+        self.network = network
+        self.min_pressure = min_pressure
+        self.catalogue = catalogue
+        self.workers = workers or os.cpu_count() or 1
+        self.random = random.Random(seed)
+
+        self.diameters = np.array([size[1] for size in catalogue])
+        self.costs = np.array([size[2] for size in catalogue])
+        self.cache = {} # sizes -> (violation, cost)
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        ''' stops a running optimization, run() then returns None '''
+        self.cancelled.set()
+
+    def cost(self, sizes):
+        return float((self.costs[list(sizes)] * self.network.length).sum())
+
+    def evaluate(self, population):
+        ''' ranks candidates, solving only those not seen before '''
+        if self.cancelled.is_set():
+            raise Cancelled()
+        new = sorted(set(population) - self.cache.keys()) # similar candidates next to each other
+        if new:
+            chunksize = max(1, len(new) // (self.workers * 4))
+            result = self.pool.map_async(_evaluate, new, chunksize=chunksize)
+            while not result.ready():
+                if self.cancelled.is_set():
+                    raise Cancelled()
+                result.wait(0.1)
+            violations = result.get()
+            for sizes, violation in zip(new, violations):
+                self.cache[sizes] = (violation, self.cost(sizes))
+        return sorted(population, key=self.cache.get)
+
+    def run(self, population=40, generations=100, keep=5, progress=None):
+        ''' returns the best designs as a list of (violation, cost, sizes), or None if cancelled '''
+        n_pipes = len(self.network.pipe_ids)
+        n_sizes = len(self.catalogue)
+        mutation = 1 / n_pipes
+
+        self.pool = multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                         initargs=(self.network, self.diameters, self.min_pressure))
+        try:
+            # seed with the largest design and the closest match to the current sizes
+            current = tuple(int(np.abs(self.diameters - d).argmin()) for d in self.network.diameter)
+            pop = [(n_sizes - 1,) * n_pipes, current]
+            while len(pop) < population:
+                pop.append(tuple(self.random.randrange(n_sizes) for _ in range(n_pipes)))
+            pop = self.evaluate(pop)
+
+            for generation in range(generations):
+                if self.cancelled.is_set():
+                    raise Cancelled()
+                children = pop[:2] # elitism
+                while len(children) < population:
+                    a, b = self.select(pop), self.select(pop)
+                    child = [self.random.choice(genes) for genes in zip(a, b)] # uniform crossover
+                    for i in range(n_pipes):
+                        if self.random.random() < mutation:
+                            child[i] = min(max(child[i] + self.random.choice((-1, 1)), 0), n_sizes - 1)
+                    children.append(tuple(child))
+                pop = self.evaluate(children)
+
+                if progress is not None:
+                    progress(generation, self.cache[pop[0]])
+
+            self.refine(pop[0])
+        except Cancelled:
+            self.pool.terminate()
+            self.pool.join()
+            return None
+        except:
+            self.pool.terminate()
+            self.pool.join()
+            raise
+        self.pool.close()
+        self.pool.join()
+
+        best = sorted(self.cache.items(), key=lambda item: item[1])[:keep]
+        return [(violation, cost, sizes) for sizes, (violation, cost) in best]
+
+    def select(self, pop):
+        ''' binary tournament, pop is sorted best first '''
+        return pop[min(self.random.randrange(len(pop)), self.random.randrange(len(pop)))]
+
+    def refine(self, sizes, rounds=REFINE_ROUNDS):
+        ''' greedy descent, takes the best single pipe step down until none is feasible
+
+        each round tries the steps with the largest savings. A pipe whose step down is
+        infeasible is not tried again, smaller pipes elsewhere only lower the pressures.
+        '''
+        if self.cache[sizes][0] > 0:
+            return sizes
+        width = max(self.workers * 4, REFINE_WIDTH)
+        blocked = set()
+        for _ in range(rounds):
+            saving = {i: (self.costs[s] - self.costs[s - 1]) * self.network.length[i]
+                      for i, s in enumerate(sizes) if s > 0 and i not in blocked}
+            pipes = sorted(saving, key=saving.get, reverse=True)[:width]
+            if not pipes:
+                return sizes
+            steps = {i: sizes[:i] + (sizes[i] - 1,) + sizes[i + 1:] for i in pipes}
+            self.evaluate(list(steps.values()))
+
+            blocked.update(i for i, step in steps.items() if self.cache[step][0] > 0)
+            feasible = [step for step in steps.values() if self.cache[step][0] == 0]
+            if not feasible:
+                continue # try the pipes with the next largest savings
+            best = min(feasible, key=self.cache.get)
+            if self.cache[best] >= self.cache[sizes]:
+                return sizes
+            sizes = best
+        return sizes
@@ -0,0 +1,168 @@
+''' steady state network hydraulics
+
+Solves pipe flows and node heads with the global gradient method (Todini & Pilati).
+Pipe head loss is h = r * Q * |Q|^(n-1) with n = pipes.n_exp:
+    n_exp == 2  Darcy-Weisbach, pipes.f is the friction factor
+    otherwise   Hazen-Williams, pipes.f is the C factor
+Units are SI - length and internal_diameter in m, flow in m3/s, head in m.
+Nodes carry no elevation, so pressure head equals total head.
+'''
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+
+G = 9.81 # m/s2
+VISCOSITY = 1.004e-6 # kinematic viscosity of water at 20 C, m2/s
+MIN_FLOW = 1e-8 # m3/s, keeps the gradient of zero flow pipes finite
+
+
+class Network:
+    def __init__(self, node_ids, head, head_known, inflow, pipe_ids, node1, node2, length, diameter, f, n_exp):
+        ''' network arrays, nodes and pipes are addressed by array index
+
+        node1/node2 are node indexes, flow is positive from node1 to node2
+        '''
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.head = np.asarray(head, dtype=float)
+        self.known = np.asarray(head_known, dtype=bool)
+        self.inflow = np.asarray(inflow, dtype=float)
+        self.pipe_ids = np.asarray(pipe_ids, dtype=np.int64)
+        self.node1 = np.asarray(node1, dtype=np.int64)
+        self.node2 = np.asarray(node2, dtype=np.int64)
+        self.length = np.asarray(length, dtype=float)
+        self.diameter = np.asarray(diameter, dtype=float)
+        self.f = np.asarray(f, dtype=float)
+        self.n_exp = np.asarray(n_exp, dtype=float)
+
+        self.validate()
+
+        # fixed head nodes (reservoirs/tanks) and nodes solved for
+        self.known_nodes = np.flatnonzero(self.known)
+        self.unknown_nodes = np.flatnonzero(~self.known)
+
+        # incidence matrices, -1 at the upstream and +1 at the downstream end of each pipe
+        n_pipes = len(self.pipe_ids)
+        column = np.full(len(self.node_ids), -1)
+        column[self.unknown_nodes] = np.arange(len(self.unknown_nodes))
+        column[self.known_nodes] = np.arange(len(self.known_nodes))
+        rows = np.concatenate([np.arange(n_pipes), np.arange(n_pipes)])
+        ends = np.concatenate([self.node1, self.node2])
+        signs = np.concatenate([-np.ones(n_pipes), np.ones(n_pipes)])
+        unknown = ~self.known[ends]
+        self.A12 = sp.csr_matrix((signs[unknown], (rows[unknown], column[ends[unknown]])),
+                                 shape=(n_pipes, len(self.unknown_nodes)))
+        self.A10 = sp.csr_matrix((signs[~unknown], (rows[~unknown], column[ends[~unknown]])),
+                                 shape=(n_pipes, len(self.known_nodes)))
+        self.A21 = self.A12.T.tocsr()
+
+        self.r = self.resistance()
+
+    @classmethod
+    def from_db(cls, db):
+        ''' builds the network arrays from the model database '''
+        cursor = db.cursor()
+        nodes = cursor.execute('SELECT id, head, head_known, inflow FROM nodes ORDER BY id').fetchall()
+        pipes = cursor.execute('''
+                               SELECT id, node1, node2, length, internal_diameter, f, n_exp
+                               FROM pipes
+                               WHERE node1 IN (SELECT id FROM nodes) AND node2 IN (SELECT id FROM nodes)
+                               ORDER BY id
+                               ''').fetchall()
+        cursor.close()
+
+        if not nodes or not pipes:
+            raise ValueError('The model has no connected pipes to solve.')
+
+        index = {node[0]: i for i, node in enumerate(nodes)}
+        node_ids, head, head_known, inflow = zip(*[(n[0], n[1] or 0, n[2] or 0, n[3] or 0) for n in nodes])
+        pipe_ids, node1, node2, length, diameter, f, n_exp = zip(*pipes)
+
+        return cls(node_ids, head, head_known, inflow,
+                   pipe_ids, [index[int(n)] for n in node1], [index[int(n)] for n in node2],
+                   length, diameter, f, n_exp)
+
+    def validate(self):
+        bad = [self.length, self.diameter, self.f, self.n_exp]
+        bad = self.pipe_ids[np.any([~(values > 0) for values in bad], axis=0)]
+        if len(bad):
+            raise ValueError(f'Pipes need a positive length, internal_diameter, f and n_exp: {bad.tolist()}')
+        if not self.known.any():
+            raise ValueError('At least one node needs a known head.')
+
+    def friction_exponent(self):
+        ''' exponent a of r ~ f^a, 1 for Darcy-Weisbach and -n for Hazen-Williams '''
+        return np.where(self.n_exp == 2, 1.0, -self.n_exp)
+
+    def resistance(self, diameter=None, f=None):
+        ''' pipe resistance r, optionally for trial diameters or friction values '''
+        d = self.diameter if diameter is None else diameter
+        f = self.f if f is None else f
+        darcy = 8 * f * self.length / (G * np.pi ** 2 * d ** 5)
+        hazen = 10.67 * self.length / (f ** self.n_exp * d ** 4.87)
+        return np.where(self.n_exp == 2, darcy, hazen)
+
+    def solve(self, r=None, flow=None, tol=1e-6, max_iter=50):
+        ''' solves the network, flow is an optional warm start '''
+        r = self.r if r is None else r
+        n = self.n_exp
+        h0 = self.head[self.known_nodes]
+        inflow = self.inflow[self.unknown_nodes]
+        fixed = self.A10 @ h0
+
+        if flow is None:
+            flow = np.pi * self.diameter ** 2 / 4 # 1 m/s in every pipe
+        q = np.array(flow, dtype=float)
+
+        for iteration in range(1, max_iter + 1):
+            aq = np.maximum(np.abs(q), MIN_FLOW)
+            loss = r * q * aq ** (n - 1)
+            dinv = 1 / (n * r * aq ** (n - 1))
+
+            # S H = A21 Q + q_in - A21 D^-1 (h(Q) + A10 H0)
+            S = (self.A21 @ sp.diags(dinv) @ self.A12).tocsc()
+            try:
+                factor = splu(S)
+            except RuntimeError:
+                raise ValueError('Every node must be connected to a node with a known head.')
+            rhs = self.A21 @ q + inflow - self.A21 @ (dinv * (loss + fixed))
+            h = factor.solve(rhs)
+
+            q_new = q - dinv * (loss + self.A12 @ h + fixed)
+            change = np.abs(q_new - q).sum() / max(np.abs(q_new).sum(), MIN_FLOW)
+            q = q_new
+            if change < tol:
+                break
+        else:
+            raise ValueError(f'The network did not converge in {max_iter} iterations.')
+
+        head = self.head.copy()
+        head[self.unknown_nodes] = h
+        return Solution(q, head, factor, dinv, iteration)
+
+
+class Solution:
+    def __init__(self, flow, head, factor, dinv, iterations):
+        ''' solved flows and heads, with the factorized system of the last iteration '''
+        self.flow = flow
+        self.head = head
+        self.factor = factor
+        self.dinv = dinv
+        self.iterations = iterations
+
+
+def write_results(db, network, solution):
+    ''' writes solved flows and heads back to the pipes and nodes tables '''
+    q = solution.flow
+    area = np.pi * network.diameter ** 2 / 4
+    v = np.abs(q) / area
+    Re = v * network.diameter / VISCOSITY
+
+    cursor = db.cursor()
+    cursor.executemany('UPDATE pipes SET flow = ?, flow_direction = ?, v = ?, Re = ? WHERE id = ?',
+                       zip(np.abs(q).tolist(), np.sign(q).astype(int).tolist(), v.tolist(), Re.tolist(),
+                           network.pipe_ids.tolist()))
+    cursor.executemany('UPDATE nodes SET head = ?, pressure = ? WHERE id = ?',
+                       zip(solution.head.tolist(), solution.head.tolist(), network.node_ids.tolist()))
+    db.commit()
+    cursor.close()
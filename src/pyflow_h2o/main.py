@@ -1,5 +1,6 @@
 import tkinter as tk
 from tkinter import messagebox
+from tkinter import simpledialog
 from tkinter.filedialog import asksaveasfilename
 from tkinter.filedialog import askopenfilename
 import tkinter.ttk as ttk
@@ -10,12 +11,15 @@ import sqlite3
 from ctypes import *
 import configparser
 import os
+import json
+import threading
 
 import string
 import random
 
 # windows display scaling compatibility
-windll.shcore.SetProcessDpiAwareness(1)
+if sys.platform == 'win32':
+    windll.shcore.SetProcessDpiAwareness(1)
 
 # this script's file path
 app_dir = os.path.dirname(os.path.abspath(__file__))
@@ -28,6 +32,174 @@ config_parser.read(config_file_path)
 def read_config(parser_instance, setting, attribute):
     return config_parser.get(setting, attribute)
 
+# autosave settings - interval in milliseconds, pages copied per backup step
+AUTOSAVE_INTERVAL = config_parser.getint('AUTOSAVE', 'interval', fallback=60000)
+AUTOSAVE_PAGES = config_parser.getint('AUTOSAVE', 'pages', fallback=64)
+AUTOSAVE_POLL = 100 # ms between checks on a running autosave
+
+# per user folder for the recovery files of models that have not been saved yet
+recovery_dir = os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), 'PyFlow H2O', 'recovery')
+
+def process_running(pid):
+    ''' True if the process with this id is still alive '''
+    if sys.platform != 'win32':
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True # alive, owned by another user
+        return True
+    handle = windll.kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+    if not handle:
+        return False
+    exit_code = c_ulong()
+    windll.kernel32.GetExitCodeProcess(handle, byref(exit_code))
+    windll.kernel32.CloseHandle(handle)
+    return exit_code.value == 259 # STILL_ACTIVE
+
+def recovery_owner(filepath):
+    ''' id of the running process that holds the recovery files of a model file, or None '''
+    try:
+        with open(filepath + '.owner') as f:
+            pid = int(f.read())
+    except (OSError, ValueError):
+        return None
+    if pid == os.getpid() or process_running(pid):
+        return pid
+    return None # left behind by a session that crashed
+
+class Journal:
+    def __init__(self, db, path):
+        ''' records model edits as row deltas for undo/redo and crash recovery
+
+        a delta is (table, id, before, after) - for inserts and deletes before/after
+        are full rows, or None if the row does not exist on that side of the edit,
+        for updates they are dicts of {column name: value} holding only changed columns
+        '''
+        self.db = db
+        self.path = path # crash journal, one json entry per line
+        self.file = None
+        self.undo_stack = []
+        self.redo_stack = []
+        self.dirty = False # model changed since the last autosave
+
+    def apply(self, deltas):
+        ''' applies a new edit to the model as one undoable step '''
+        self.commit('do', deltas, 'after')
+        self.undo_stack.append(deltas)
+        self.redo_stack.clear()
+
+    def undo(self):
+        ''' reverts the last edit, returns the reverted deltas '''
+        if not self.undo_stack:
+            return []
+        deltas = self.undo_stack[-1]
+        self.commit('undo', deltas, 'before')
+        self.redo_stack.append(self.undo_stack.pop())
+        return deltas
+
+    def redo(self):
+        ''' re-applies the last undone edit, returns the re-applied deltas '''
+        if not self.redo_stack:
+            return []
+        deltas = self.redo_stack[-1]
+        self.commit('redo', deltas, 'after')
+        self.undo_stack.append(self.redo_stack.pop())
+        return deltas
+
+    def commit(self, op, deltas, side):
+        ''' writes an edit and journals it, the edit is rolled back if the journal write fails '''
+        try:
+            self.write(deltas[::-1] if side == 'before' else deltas, side)
+            self.log(op, deltas)
+        except:
+            self.db.rollback()
+            raise
+        self.db.commit()
+        self.dirty = True
+
+    def write(self, deltas, side):
+        ''' sets each row to its before or after state - safe to repeat '''
+        cursor = self.db.cursor()
+        for table, row_id, before, after in deltas:
+            row = before if side == 'before' else after
+            if row is None:
+                cursor.execute(f'DELETE FROM {table} WHERE id = ?', (row_id,))
+            elif isinstance(row, dict):
+                columns = ', '.join(f'{column} = ?' for column in row)
+                cursor.execute(f'UPDATE {table} SET {columns} WHERE id = ?', (*row.values(), row_id))
+            else:
+                placeholders = ', '.join('?' for _ in row)
+                cursor.execute(f'INSERT OR REPLACE INTO {table} VALUES({placeholders})', row)
+        cursor.close()
+
+    def log(self, op, deltas):
+        ''' appends an entry to the crash journal and flushes it to disk '''
+        if self.path is None:
+            return
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        self.file.write(json.dumps([op, deltas]) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def replay(self, replay_path):
+        ''' re-applies a crash journal on top of the last autosave '''
+        path, self.path = self.path, None # do not log entries while replaying
+        with open(replay_path) as f:
+            for line in f:
+                try:
+                    op, deltas = json.loads(line)
+                except ValueError:
+                    break # entry cut short by the crash
+                deltas = [tuple(delta) for delta in deltas]
+
+                # undo/redo entries carry their deltas, edits made before the
+                # last autosave are no longer on the stacks
+                if op == 'do':
+                    self.apply(deltas)
+                elif op == 'undo':
+                    self.commit(op, deltas, 'before')
+                    if self.undo_stack:
+                        self.undo_stack.pop()
+                    self.redo_stack.append(deltas)
+                elif op == 'redo':
+                    self.commit(op, deltas, 'after')
+                    if self.redo_stack:
+                        self.redo_stack.pop()
+                    self.undo_stack.append(deltas)
+        self.path = path
+
+    def rotate(self):
+        ''' moves the entries logged so far to the .prev journal, new entries start a fresh file '''
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        if os.path.exists(self.prev_path()):
+            # an earlier autosave failed, keep its entries ahead of the new ones
+            with open(self.prev_path(), 'a') as prev, open(self.path) as f:
+                prev.write(f.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.prev_path())
+
+    def prev_path(self):
+        return self.path + '.prev'
+
+    def truncate(self):
+        ''' empties the crash journals '''
+        self.close()
+        if self.path is not None:
+            for path in (self.prev_path(), self.path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
 class Model:
     def __init__(self, parent, filepath):
         self.parent = parent
@@ -40,6 +212,8 @@ class Model:
 
         # open a database in memory - working db
         self.open_db(":memory:")
+        self.journal = Journal(self.db, None)
+        self.has_results = True # a loaded file may hold solver results
 
         if filepath == None:
             self.filepath = None
@@ -54,9 +228,13 @@ class Model:
             self.filepath = None
             self.new_db()
 
+        self.set_recovery_paths()
+
 
     def open_db(self, connect_string):
-        self.db = sqlite3.connect(connect_string)
+        # autosave backs the db up from a worker thread
+        self.db = sqlite3.connect(connect_string, check_same_thread=False)
+        self.autosave_thread = None
 
     def new_db(self):
         ''' if no model file is provided, build database tables '''
@@ -186,6 +364,215 @@ class Model:
         # get count of columns
         self.count_cols()
 
+    def get_row(self, table, row_id):
+        cursor = self.db.cursor()
+        row = cursor.execute(f'SELECT * FROM {table} WHERE id = ?', (row_id,)).fetchone()
+        cursor.close()
+        return row
+
+    def insert_row(self, table, row):
+        ''' inserts a new row as an undoable edit '''
+        self.journal.apply([(table, row[0], None, tuple(row))])
+        self.clear_results()
+
+    def delete_row(self, table, row_id):
+        ''' deletes a row as an undoable edit '''
+        before = self.get_row(table, row_id)
+        if before is not None:
+            self.journal.apply([(table, before[0], before, None)])
+            self.clear_results()
+
+    def update_rows(self, table, updates):
+        ''' updates columns of several rows as one undoable edit
+
+        updates maps row id to a dict of {column name: new value}, only the
+        columns that change are journaled
+        '''
+        cursor = self.db.cursor()
+        columns = [col[1] for col in cursor.execute(f"SELECT * FROM pragma_table_info('{table}')")]
+        cursor.close()
+
+        deltas = []
+        for row_id, values in updates.items():
+            row = self.get_row(table, row_id)
+            if row is None:
+                continue
+            before = {column: row[columns.index(column)] for column in values}
+            after = {column: value for column, value in values.items() if before[column] != value}
+            before = {column: before[column] for column in after}
+            if after:
+                deltas.append((table, row[0], before, after))
+
+        if deltas:
+            self.journal.apply(deltas)
+            self.clear_results()
+
+    def undo(self):
+        ''' reverts the last edit, returns the reverted deltas '''
+        deltas = self.journal.undo()
+        if deltas:
+            self.clear_results()
+        return deltas
+
+    def redo(self):
+        ''' re-applies the last undone edit, returns the re-applied deltas '''
+        deltas = self.journal.redo()
+        if deltas:
+            self.clear_results()
+        return deltas
+
+    def write_results(self, network, solution):
+        ''' stores solver results, they are not journaled and are cleared by the next edit '''
+        import hydraulics
+
+        hydraulics.write_results(self.db, network, solution)
+        self.has_results = True
+        self.journal.dirty = True
+
+    def clear_results(self):
+        ''' results only hold for the design they were solved for, so any edit clears them '''
+        if not self.has_results:
+            return
+        cursor = self.db.cursor()
+        cursor.execute('UPDATE pipes SET flow = NULL, flow_direction = NULL, v = NULL, Re = NULL')
+        cursor.execute('UPDATE nodes SET pressure = NULL')
+        cursor.execute('UPDATE nodes SET head = NULL WHERE NOT head_known') # known heads are input
+        self.db.commit()
+        cursor.close()
+        self.has_results = False
+        self.journal.dirty = True
+
+    def set_recovery_paths(self):
+        ''' points the autosave and crash journal at files next to the model
+
+        untitled models use files named after this process in the user's recovery folder
+        '''
+        self.journal.close()
+        self.owner_path = None
+        untitled = os.path.join(recovery_dir, f'untitled-{os.getpid()}.pfh')
+        if self.filepath is None:
+            os.makedirs(recovery_dir, exist_ok=True)
+            base = untitled
+        elif recovery_owner(self.filepath) not in (None, os.getpid()):
+            # another running instance has this file open, keep out of its recovery files
+            os.makedirs(recovery_dir, exist_ok=True)
+            base = untitled
+        else:
+            base = self.filepath
+            self.owner_path = base + '.owner'
+            with open(self.owner_path, 'w') as f:
+                f.write(str(os.getpid()))
+        self.autosave_path = base + '.autosave'
+        self.journal.path = base + '.journal'
+
+    def has_recovery(self):
+        ''' True if a previous session ended without saving or closing cleanly '''
+        if self.filepath is None:
+            self.adopt_untitled_recovery()
+        return any(os.path.exists(path) for path in (self.autosave_path, self.journal.prev_path(), self.journal.path))
+
+    def adopt_untitled_recovery(self):
+        ''' takes over the newest recovery files left behind by an untitled session that crashed '''
+        orphans = {}
+        for name in os.listdir(recovery_dir):
+            pid = name.split('.')[0][len('untitled-'):]
+            if name.startswith('untitled-') and pid.isdigit() and int(pid) != os.getpid():
+                orphans.setdefault(int(pid), []).append(name)
+
+        orphans = {pid: names for pid, names in orphans.items() if not process_running(pid)}
+        if not orphans:
+            return
+
+        names = max(orphans.values(), key=lambda names: max(os.path.getmtime(os.path.join(recovery_dir, name))
+                                                            for name in names))
+        for name in names:
+            for path in (self.autosave_path, self.journal.prev_path(), self.journal.path):
+                if name.endswith(os.path.splitext(path)[1]):
+                    os.replace(os.path.join(recovery_dir, name), path)
+
+    def recover(self):
+        ''' restores the last autosave and replays the crash journal on top of it '''
+        if os.path.exists(self.autosave_path):
+            source = sqlite3.connect(self.autosave_path)
+            source.backup(self.db)
+            source.close()
+        for path in (self.journal.prev_path(), self.journal.path):
+            if os.path.exists(path):
+                self.journal.replay(path)
+        self.clear_results()
+        self.journal.dirty = True
+        self.count_cols()
+
+    def discard_recovery(self):
+        ''' removes the autosave, crash journal and owner files '''
+        self.journal.truncate()
+        for path in (self.autosave_path, self.owner_path):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def start_autosave(self):
+        ''' starts copying the working db to the autosave file on a worker thread
+
+        returns False if there is nothing new to save. Entries logged so far move
+        to the .prev journal, which is dropped once the autosave is in place. Edits
+        made while the copy runs go to the fresh journal - replaying them on top of
+        an autosave that already holds them is harmless.
+        '''
+        if not self.journal.dirty or self.autosave_thread is not None:
+            return False
+
+        self.journal.rotate()
+        self.journal.dirty = False
+        self.autosave_error = None
+        self.autosave_thread = threading.Thread(target=self.run_autosave, daemon=True)
+        self.autosave_thread.start()
+        return True
+
+    def run_autosave(self):
+        try:
+            self.backup_to(self.autosave_path + '.tmp', redraw=False)
+        except Exception as e:
+            self.autosave_error = e
+
+    def autosave_running(self):
+        return self.autosave_thread is not None and self.autosave_thread.is_alive()
+
+    def finish_autosave(self):
+        ''' waits for a running autosave and puts the new autosave file in place '''
+        if self.autosave_thread is None:
+            return
+        self.autosave_thread.join()
+        self.autosave_thread = None
+
+        if self.autosave_error is not None:
+            self.journal.dirty = True # .prev is kept and retried with the next autosave
+            raise self.autosave_error
+
+        os.replace(self.autosave_path + '.tmp', self.autosave_path) # never leave a half written autosave
+        prev_path = self.journal.prev_path()
+        if os.path.exists(prev_path):
+            os.remove(prev_path)
+
+    def backup_to(self, filepath, redraw=True):
+        ''' paged backup of the working db, optionally redrawing the window between pages '''
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        conn = sqlite3.connect(filepath)
+        with conn:
+            self.db.backup(conn, pages=AUTOSAVE_PAGES, progress=self.backup_progress if redraw else None)
+        conn.close()
+
+    def backup_progress(self, status, remaining, total):
+        self.parent.update_idletasks()
+
+    def close(self):
+        ''' closes the model, discarding unsaved recovery data '''
+        try:
+            self.finish_autosave()
+        finally:
+            self.discard_recovery()
+            self.db.close()
+
 class Main(tk.Frame):
     def __init__(self, parent):
         ''' reads config file and creates main canvas '''
@@ -249,6 +636,32 @@ class Main(tk.Frame):
         pipe_width = 3 # pipe width
         self.canvas.create_line(x1, y1, x2, y2, tag=('all','pipe', id), fill='black', width=pipe_width)
 
+    def redraw_item(self, table, row_id):
+        ''' redraws a node or pipe from its current database row '''
+        if table == 'nodes':
+            tag = f'n-{row_id}'
+            sql = 'SELECT x, y FROM nodes WHERE id = ?'
+        else:
+            tag = f'p-{row_id}'
+            sql = '''
+                  SELECT n1.x, n1.y, n2.x, n2.y
+                  FROM pipes
+                  INNER JOIN nodes n1 on pipes.node1 = n1.id
+                  INNER JOIN nodes n2 on pipes.node2 = n2.id
+                  WHERE pipes.id = ?
+                  '''
+
+        self.canvas.delete(tag)
+        cursor = self.parent.model.db.cursor()
+        coords = cursor.execute(sql, (row_id,)).fetchone()
+        cursor.close()
+
+        if coords is not None:
+            if table == 'nodes':
+                self.draw_node(tag, *coords)
+            else:
+                self.draw_line(tag, *coords)
+
     def action_leftclick(self, event):
         ''' handles canvas click events '''
         if self.parent.mode == 'node' and self.parent.draw_mode == 'add':
@@ -260,21 +673,19 @@ class Main(tk.Frame):
             cursor = self.parent.model.db.cursor()
             cursor.execute('SELECT max(id) FROM nodes')
             max_id = cursor.fetchall()
+            cursor.close()
 
             if max_id[0][0] is None:
                 new_node[0] = 1 # blank model, start id from 0
             else:
                 new_node[0] = max_id[0][0] + 1 # pick next availablee id number
 
+            # insert new node into database
+            self.parent.model.insert_row('nodes', new_node)
+
             # draw the new node
             self.draw_node(f'n-{new_node[0]}', event.x, event.y)
 
-            # insert new node into database
-            new_node_sql = ', '.join(str(i) for i in new_node)
-            cursor.execute(f'INSERT INTO nodes VALUES({new_node_sql})')
-            self.parent.model.db.commit()
-            cursor.close()
-
         elif self.parent.mode == 'node' and self.parent.draw_mode == 'delete':
             try:
                 # get list of canvas objects below cursor
@@ -305,10 +716,7 @@ class Main(tk.Frame):
                     self.canvas.delete(node_tag)
 
                     # delete node from database
-                    delete_node_sql = f'DELETE FROM nodes WHERE ID = {node_id}'
-                    self.parent.model.db.cursor().execute(delete_node_sql)
-                    self.parent.model.db.commit()
-                    self.parent.model.db.cursor().close()
+                    self.parent.model.delete_row('nodes', int(node_id))
 
             except:
                 pass
@@ -362,6 +770,7 @@ class Main(tk.Frame):
                         cursor = self.parent.model.db.cursor()
                         cursor.execute('SELECT max(id) FROM pipes')
                         max_id = cursor.fetchall()
+                        cursor.close()
 
                         if max_id[0][0] is None:
                             new_pipe[0] = 1  # blank model, start id from 0
@@ -379,13 +788,10 @@ class Main(tk.Frame):
                         self.parent.drawing = False
                         self.canvas.unbind('<Motion>')
                         self.canvas.delete(self.cur_id)
-                        self.draw_line(f'p-{new_pipe[0]}', self.x1, self.y1, self.x2, self.y2)
 
                         # insert new pipe into database
-                        new_pipe_sql = ', '.join(str(i) for i in new_pipe)
-                        cursor.execute(f'INSERT INTO pipes VALUES({new_pipe_sql})')
-                        self.parent.model.db.commit()
-                        cursor.close()
+                        self.parent.model.insert_row('pipes', new_pipe)
+                        self.draw_line(f'p-{new_pipe[0]}', self.x1, self.y1, self.x2, self.y2)
                 except:
                     pass
         elif self.parent.mode == 'pipe' and self.parent.draw_mode == 'delete':
@@ -404,14 +810,11 @@ class Main(tk.Frame):
                 print(pipe_id)
 
                 if pipe_id != None:
+                    # delete pipe from database
+                    self.parent.model.delete_row('pipes', int(pipe_id))
+
                     # delete pipe from canvas
                     self.canvas.delete(pipe_tag)
-
-                    # delete pipe from database
-                    delete_pipe_sql = f'DELETE FROM pipes WHERE ID = {pipe_id}'
-                    self.parent.model.db.cursor().execute(delete_pipe_sql)
-                    self.parent.model.db.commit()
-                    self.parent.model.db.cursor().close()
             except:
                 pass
         else:
@@ -568,6 +971,258 @@ class MainApplication(tk.Frame):
         # create canvas
         self.initUI()
 
+        # offer to restore unsaved work from a previous session, then start autosaving
+        self.check_recovery()
+        self.after(AUTOSAVE_INTERVAL, self.autosave)
+
+    def check_recovery(self):
+        ''' restores the model from its autosave and crash journal if the user agrees '''
+        if not self.model.has_recovery():
+            return
+
+        if messagebox.askyesno('Recover', 'Unsaved changes from a previous session were found. Recover them?'):
+            self.model.recover()
+            self.main.canvas.delete('all')
+            self.model.load_model()
+        else:
+            self.model.discard_recovery()
+
+    def autosave(self):
+        ''' periodically starts a background autosave of the working model '''
+        if self.model.start_autosave():
+            self.after(AUTOSAVE_POLL, self.poll_autosave)
+        else:
+            self.after(AUTOSAVE_INTERVAL, self.autosave)
+
+    def poll_autosave(self):
+        ''' checks on a running autosave without blocking the window '''
+        if self.model.autosave_running():
+            self.after(AUTOSAVE_POLL, self.poll_autosave)
+            return
+
+        try:
+            self.model.finish_autosave()
+        except Exception as e:
+            messagebox.showerror('Autosave', f'Autosave failed, it will be retried: {e}')
+        finally:
+            self.after(AUTOSAVE_INTERVAL, self.autosave)
+
+    def undo(self):
+        for table, row_id, before, after in self.model.undo():
+            self.main.redraw_item(table, row_id)
+
+    def redo(self):
+        for table, row_id, before, after in self.model.redo():
+            self.main.redraw_item(table, row_id)
+
+    # the analysis modules need numpy and scipy, so they are only imported when used
+
+    def solve_network(self):
+        ''' solves flows and heads and writes them to the model '''
+        import hydraulics
+
+        try:
+            network = hydraulics.Network.from_db(self.model.db)
+            solution = network.solve()
+        except ValueError as e:
+            messagebox.showerror('Solve Network', str(e))
+            return None
+
+        self.model.write_results(network, solution)
+        return network, solution
+
+    def optimize_pipes(self):
+        ''' sizes every pipe from the catalogue for the lowest cost meeting a minimum pressure '''
+        import hydraulics
+        import design
+
+        min_pressure = simpledialog.askfloat('Optimize Pipe Sizes', 'Minimum pressure head (m):', minvalue=0)
+        if min_pressure is None:
+            return
+
+        try:
+            network = hydraulics.Network.from_db(self.model.db)
+        except ValueError as e:
+            messagebox.showerror('Optimize Pipe Sizes', str(e))
+            return
+
+        optimizer = design.Optimizer(network, min_pressure)
+
+        # progress window, the optimizer runs on a background thread and is polled with after()
+        dialog = tk.Toplevel(self)
+        dialog.title('Optimize Pipe Sizes')
+        dialog.transient(self.parent)
+        status = tk.StringVar(dialog, 'Evaluating the first generation...')
+        tk.Label(dialog, textvariable=status, width=50, padx=10, pady=10).pack(side='top')
+        tk.Button(dialog, text='Cancel', command=optimizer.cancel).pack(side='top', pady=(0, 10))
+        dialog.protocol('WM_DELETE_WINDOW', optimizer.cancel)
+        dialog.grab_set() # no edits while the design is being worked out
+
+        outcome = {}
+        def progress(generation, best):
+            outcome['progress'] = (generation, best)
+
+        def run():
+            try:
+                outcome['designs'] = optimizer.run(progress=progress)
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.after(200, self.poll_optimizer, optimizer, network, thread, dialog, status, outcome)
+
+    def poll_optimizer(self, optimizer, network, thread, dialog, status, outcome):
+        ''' updates the progress window until the optimizer finishes, then applies the best design '''
+        if thread.is_alive():
+            if optimizer.cancelled.is_set():
+                status.set('Cancelling...')
+            elif 'progress' in outcome:
+                generation, (violation, cost) = outcome['progress']
+                feasible = '' if violation == 0 else ' (infeasible)'
+                status.set(f'Generation {generation + 1}, best cost {cost:,.0f}{feasible}')
+            self.after(200, self.poll_optimizer, optimizer, network, thread, dialog, status, outcome)
+            return
+
+        dialog.destroy()
+        if 'error' in outcome:
+            messagebox.showerror('Optimize Pipe Sizes', str(outcome['error']))
+            return
+        designs = outcome['designs']
+        if designs is None: # cancelled
+            return
+
+        violation, cost, sizes = designs[0]
+        if violation > 0:
+            messagebox.showerror('Optimize Pipe Sizes', 'No design in the catalogue meets the minimum pressure.')
+            return
+
+        # write the best design as one undoable edit
+        updates = {}
+        for pipe_id, size in zip(network.pipe_ids.tolist(), sizes):
+            nominal, internal, unit_cost = optimizer.catalogue[size]
+            updates[pipe_id] = {'nominal_diameter': nominal, 'internal_diameter': internal}
+        self.model.update_rows('pipes', updates)
+        self.solve_network()
+
+        report = '\n'.join(f'{i + 1}. cost {cost:,.0f}' + (' (infeasible)' if violation > 0 else '')
+                           for i, (violation, cost, sizes) in enumerate(designs))
+        messagebox.showinfo('Optimize Pipe Sizes', f'Best designs, the first was applied:\n{report}')
+
+    def water_quality(self):
+        ''' runs water age and chlorine transport on the solved flows and saves the node results '''
+        import quality
+
+        hours = simpledialog.askfloat('Water Quality', 'Duration (hours):', initialvalue=72, minvalue=1)
+        if hours is None:
+            return
+        dt = simpledialog.askfloat('Water Quality', 'Time step (s):', initialvalue=60, minvalue=1)
+        if dt is None:
+            return
+        decay = simpledialog.askfloat('Water Quality', 'Chlorine bulk decay (1/day):', initialvalue=0.5, minvalue=0)
+        if decay is None:
+            return
+        source = simpledialog.askfloat('Water Quality', 'Source chlorine (mg/L):', initialvalue=1.0, minvalue=0)
+        if source is None:
+            return
+
+        # transport runs on the flows of the current design
+        if self.solve_network() is None:
+            return
+
+        try:
+            transport = quality.Transport.from_db(self.model.db, dt=dt, duration=hours * 3600, decay=decay,
+                                                  source_chlorine=source)
+        except ValueError as e:
+            messagebox.showerror('Water Quality', str(e))
+            return
+
+        # progress window, the simulation runs on a background thread and is polled with after()
+        dialog = tk.Toplevel(self)
+        dialog.title('Water Quality')
+        dialog.transient(self.parent)
+        status = tk.StringVar(dialog, 'Starting the simulation...')
+        tk.Label(dialog, textvariable=status, width=50, padx=10, pady=10).pack(side='top')
+        tk.Button(dialog, text='Cancel', command=transport.cancel).pack(side='top', pady=(0, 10))
+        dialog.protocol('WM_DELETE_WINDOW', transport.cancel)
+        dialog.grab_set()
+
+        outcome = {}
+        def run():
+            try:
+                outcome['results'] = transport.run()
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.after(200, self.poll_transport, transport, thread, dialog, status, outcome)
+
+    def poll_transport(self, transport, thread, dialog, status, outcome):
+        ''' updates the progress window until the simulation finishes, then saves the results '''
+        if thread.is_alive():
+            if transport.cancelled.is_set():
+                status.set('Cancelling...')
+            else:
+                status.set(f'Step {transport.step:,} of {transport.steps:,}')
+            self.after(200, self.poll_transport, transport, thread, dialog, status, outcome)
+            return
+
+        dialog.destroy()
+        if 'error' in outcome:
+            messagebox.showerror('Water Quality', str(outcome['error']))
+            return
+        results = outcome['results']
+        if results is None: # cancelled
+            return
+
+        files = [('NumPy archive', '*.npz'),
+                 ('All Files', '*.*')]
+        results_file = asksaveasfilename(filetypes=files, defaultextension=files)
+        if results_file != '':
+            results.save(results_file)
+
+    def calibrate_roughness(self):
+        ''' fits f per group of pipes to observed pressures and writes it to the model '''
+        import hydraulics
+        import calibration
+
+        files = [('CSV node id, pressure', '*.csv'),
+                 ('All Files', '*.*')]
+        observations_file = askopenfilename(filetypes=files)
+        if observations_file == '':
+            return
+
+        cursor = self.model.db.cursor()
+        columns = [col[1] for col in cursor.execute("SELECT * FROM pragma_table_info('pipes')")]
+        group_column = simpledialog.askstring('Calibrate Roughness', 'Group pipes by column:',
+                                             initialvalue='nominal_diameter')
+        if group_column is None:
+            cursor.close()
+            return
+        if group_column not in columns:
+            cursor.close()
+            messagebox.showerror('Calibrate Roughness', f'The pipes table has no column {group_column}.')
+            return
+        groups = dict(cursor.execute(f'SELECT id, {group_column} FROM pipes').fetchall())
+        cursor.close()
+
+        try:
+            network = hydraulics.Network.from_db(self.model.db)
+            calibrator = calibration.Calibration(network, calibration.read_observations(observations_file),
+                                                 [groups[i] for i in network.pipe_ids.tolist()])
+            f, rms_before, rms_after = calibrator.run()
+        except ValueError as e:
+            messagebox.showerror('Calibrate Roughness', str(e))
+            return
+
+        # write the calibrated values as one undoable edit
+        self.model.update_rows('pipes', {pipe_id: {'f': value}
+                                         for pipe_id, value in zip(network.pipe_ids.tolist(), f.tolist())})
+        self.solve_network()
+        messagebox.showinfo('Calibrate Roughness', f'RMS pressure error {rms_before:.3f} m -> {rms_after:.3f} m '
+                                                   f'over {len(calibrator.labels)} groups.')
+
     def save(self, save_type):
         ''' write the current model to disk '''
         # TODO: add check if database is not saved
@@ -585,15 +1240,20 @@ class MainApplication(tk.Frame):
 
 
         if saveas_file != '': # if user did not cancel the save as function
-            if os.path.exists(saveas_file): # delete existing file
-                os.remove(saveas_file)
-            conn = sqlite3.connect(saveas_file)
-            with conn:
-                for line in self.model.db.iterdump():
-                    if line not in ('BEGIN;', 'COMMIT;'): # let python handle transactions
-                        conn.execute(line)
-            conn.commit()
+            try:
+                self.model.finish_autosave()
+            except Exception:
+                pass # a failed autosave does not matter, the save below supersedes it
+
+            # copy to a temporary file first so a failed save leaves the old file in place
+            self.model.backup_to(saveas_file + '.tmp')
+            os.replace(saveas_file + '.tmp', saveas_file)
+
+            # the saved file is now the recovery base, drop the old autosave
+            self.model.discard_recovery()
             self.model.filepath = saveas_file
+            self.model.set_recovery_paths()
+            self.model.journal.dirty = False
 
     def open(self):
         files = [('PyFlow H2O model', '*.pfh'),
@@ -601,9 +1261,10 @@ class MainApplication(tk.Frame):
         open_file = askopenfilename(filetypes=files)
 
         if open_file != '': # if user did not cancel the file open function
-            self.model.db.close()
+            self.model.close()
             self.main.canvas.delete('all')
             self.model.init_db(open_file)
+            self.check_recovery()
 
     def change_mode(self, mode, draw_mode):
         ' Changes application mode between drawing, selecting, editing, etc.'
@@ -659,8 +1320,8 @@ class MainApplication(tk.Frame):
                         ]
 
         edit_commands = [
-                        ('Undo', None),
-                        ('Redo', None)
+                        ('Undo', self.undo),
+                        ('Redo', self.redo)
                         ]
 
         view_commands = [
@@ -674,6 +1335,13 @@ class MainApplication(tk.Frame):
         report_commands = [
                           ]
 
+        analysis_commands = [
+                            ('Solve Network', self.solve_network),
+                            ('Optimize Pipe Sizes...', self.optimize_pipes),
+                            ('Water Quality...', self.water_quality),
+                            ('Calibrate Roughness...', self.calibrate_roughness)
+                            ]
+
         help_commands = [
                         ('About', None)
                         ]
@@ -683,6 +1351,7 @@ class MainApplication(tk.Frame):
         self.viewmenu = self.menubar.add_menu('View', commands=view_commands)
         self.querymenu = self.menubar.add_menu('Query', commands=query_commands)
         self.reportmenu = self.menubar.add_menu('Reports', commands=report_commands)
+        self.analysismenu = self.menubar.add_menu('Analysis', commands=analysis_commands)
         self.helpmenu = self.menubar.add_menu('Help', commands=help_commands)
 
         # create top ribbon
@@ -711,7 +1380,7 @@ def on_closing():
     # TODO: add check if model has been saved or not
     if messagebox.askokcancel('Quit', 'Do you want to quit?'):
         try:
-            app.model.db.close()
+            app.model.close()
         except:
             pass
         root.destroy()
@@ -719,7 +1388,8 @@ def on_closing():
 
 if __name__ == '__main__':
     root = tk.Tk()
-    app = MainApplication(root).pack(side='top', fill='both', expand=True)
+    app = MainApplication(root)
+    app.pack(side='top', fill='both', expand=True)
     root.protocol('WM_DELETE_WINDOW', on_closing)
     root.mainloop()
 
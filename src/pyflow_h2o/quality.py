@@ -0,0 +1,189 @@
+''' water age and chlorine transport on solved steady flows
+
+Fixed lattice Lagrangian scheme - each pipe holds round(travel time / dt) cells of
+water that move one cell per time step, so a step is a single shift of one flat
+array of cells for the whole network. Water entering a node is mixed by flow from
+the pipe outlet cells with one sparse product per step. Pipes shorter than half
+a step carry no cells and pass their upstream node value straight through; their
+downstream nodes are mixed level by level in the topological flow order worked
+out once from pipes.flow_direction.
+
+Age grows by dt per step. Chlorine decays first order by exp(-k dt), in the pipes
+and at stagnant nodes alike. Sources are fixed head nodes and nodes with a
+positive inflow.
+
+run() blocks, so the app calls it from a background thread, reads step for
+progress and can stop it with cancel() - checked once per time step.
+'''
+
+import threading
+
+import numpy as np
+import scipy.sparse as sp
+
+import hydraulics
+
+SECONDS_PER_DAY = 86400
+
+
+class Transport:
+    def __init__(self, network, flow, velocity, dt=60.0, duration=3 * SECONDS_PER_DAY,
+                 decay=0.5, source_chlorine=1.0):
+        ''' flow is signed (positive node1 to node2), decay is the bulk coefficient in 1/day '''
+        self.network = network
+        self.dt = dt
+        self.steps = int(np.ceil(duration / dt))
+        self.step = 0 # last completed time step of a running simulation
+        self.cancelled = threading.Event()
+        n_nodes = len(network.node_ids)
+
+        # orient every flowing pipe from upstream to downstream node
+        flow = np.asarray(flow, dtype=float)
+        velocity = np.asarray(velocity, dtype=float)
+        moving = (flow != 0) & (velocity > 0)
+        pipes = np.flatnonzero(moving)
+        self.up = np.where(flow[pipes] > 0, network.node1[pipes], network.node2[pipes])
+        self.down = np.where(flow[pipes] > 0, network.node2[pipes], network.node1[pipes])
+        q = np.abs(flow[pipes])
+
+        # cells per pipe, water older than the run never reaches the outlet
+        cells = np.rint(network.length[pipes] / velocity[pipes] / dt).astype(np.int64)
+        cells = np.minimum(cells, self.steps)
+        delayed = cells > 0
+        self.delayed = np.flatnonzero(delayed)
+        self.direct = np.flatnonzero(~delayed)
+        self.last = np.cumsum(cells[delayed]) - 1 # index of each delayed pipe's outlet cell
+        self.first = self.last - cells[delayed] + 1
+        self.n_cells = int(cells.sum())
+
+        # external sources mix in with the pipe inflows
+        self.sources = network.known | (network.inflow > 0)
+        source_flow = np.where(network.known, 0, np.maximum(network.inflow, 0))
+        self.source_value = np.zeros((2, n_nodes))
+        self.source_value[1, self.sources] = source_chlorine
+        self.source_flow = source_flow
+
+        # node inflow from pipe outlets, delayed pipes and each level of direct pipes
+        self.delayed_mix = sp.csr_matrix((q[delayed], (self.down[delayed], np.arange(delayed.sum()))),
+                                         shape=(n_nodes, delayed.sum()))
+        self.total = np.bincount(self.down, weights=q, minlength=n_nodes) + source_flow
+        self.levels = self.direct_levels(n_nodes, q)
+
+        # per step change of (age, chlorine)
+        self.factor = np.array([[1.0], [np.exp(-decay / SECONDS_PER_DAY * dt)]])
+        self.growth = np.array([[dt], [0.0]])
+
+    def direct_levels(self, n_nodes, q):
+        ''' groups direct pipes by the topological level of their downstream node '''
+        up, down = self.up[self.direct], self.down[self.direct]
+        outgoing = [[] for _ in range(n_nodes)]
+        for p, node in enumerate(up.tolist()):
+            outgoing[node].append(p)
+
+        # longest path from a node without direct inflow
+        level = np.zeros(n_nodes, dtype=np.int64)
+        incoming = np.bincount(down, minlength=n_nodes)
+        ready = np.flatnonzero(incoming == 0).tolist()
+        visited = 0
+        while ready:
+            node = ready.pop()
+            visited += 1
+            for p in outgoing[node]:
+                level[down[p]] = max(level[down[p]], level[node] + 1)
+                incoming[down[p]] -= 1
+                if incoming[down[p]] == 0:
+                    ready.append(down[p])
+        if visited < n_nodes:
+            raise ValueError('Flows circulate around a loop of pipes shorter than half a time step '
+                             f'({self.dt:g} s), use a shorter time step.')
+
+        # fixed head nodes keep their source value
+        levels = []
+        for l in range(1, level.max() + 1):
+            pipes = np.flatnonzero((level[down] == l) & ~self.network.known[down])
+            nodes = np.unique(down[pipes])
+            local = np.searchsorted(nodes, down[pipes])
+            mix = sp.csr_matrix((q[self.direct][pipes], (local, np.arange(len(pipes)))),
+                                shape=(len(nodes), len(pipes)))
+            levels.append((nodes, up[pipes], mix))
+        return levels
+
+    @classmethod
+    def from_db(cls, db, **kwargs):
+        ''' builds the transport model from solved flows in the model database '''
+        network = hydraulics.Network.from_db(db)
+        cursor = db.cursor()
+        rows = cursor.execute('SELECT id, flow, flow_direction, v FROM pipes').fetchall()
+        cursor.close()
+
+        solved = {row[0]: row[1:] for row in rows}
+        flow, direction, velocity = np.array([solved[i] for i in network.pipe_ids.tolist()], dtype=float).T
+        flow = flow * direction
+
+        # results are cleared by edits, and must still balance the node demands
+        if np.isnan(flow).any() or np.isnan(velocity).any() or not flow.any():
+            raise ValueError('The model has no solved flows, solve the network first.')
+        balance = network.A21 @ flow + network.inflow[network.unknown_nodes]
+        if np.abs(balance).max() > 1e-6 * max(np.abs(network.inflow).sum(), 1e-9):
+            raise ValueError('The stored flows do not meet the node demands, solve the network again.')
+
+        return cls(network, flow, velocity, **kwargs)
+
+    def cancel(self):
+        ''' stops a running simulation, run() then returns None '''
+        self.cancelled.set()
+
+    def run(self, report_step=3600.0, initial=(0.0, 0.0)):
+        ''' runs the simulation, returns node results every report_step seconds, or None if cancelled '''
+        n_nodes = len(self.network.node_ids)
+        cells = np.empty((2, self.n_cells))
+        cells[:] = np.reshape(initial, (2, 1))
+        values = np.empty((2, n_nodes))
+        values[:] = np.reshape(initial, (2, 1))
+        values[:, self.sources] = self.source_value[:, self.sources]
+
+        flowing = self.total > 0
+        source_load = self.source_value * self.source_flow
+        report_every = max(1, int(round(report_step / self.dt)))
+        reports = [values.astype(np.float32)]
+
+        for step in range(1, self.steps + 1):
+            if self.cancelled.is_set():
+                return None
+
+            # node mixing from the water leaving delayed pipes
+            load = (self.delayed_mix @ cells[:, self.last].T).T + source_load
+            # water standing at nodes without inflow keeps ageing and decaying
+            values = np.where(flowing, load / np.where(flowing, self.total, 1), values * self.factor + self.growth)
+            values[:, self.network.known] = self.source_value[:, self.network.known]
+
+            # then through direct pipes, upstream levels first
+            for nodes, up, mix in self.levels:
+                values[:, nodes] = (load[:, nodes] + (mix @ values[:, up].T).T) / self.total[nodes]
+
+            # move every pipe one cell downstream and fill the inlets
+            cells[:, 1:] = cells[:, :-1]
+            cells[:, self.first] = values[:, self.up[self.delayed]]
+            cells *= self.factor
+            cells += self.growth
+
+            if step % report_every == 0:
+                reports.append(values.astype(np.float32))
+            self.step = step
+
+        reports = np.array(reports)
+        times = np.arange(len(reports)) * report_every * self.dt
+        return QualityResults(self.network.node_ids, times, reports[:, 0] / 3600, reports[:, 1])
+
+
+class QualityResults:
+    def __init__(self, node_ids, times, age, chlorine):
+        ''' per node results, rows are report times (s), age in hours and chlorine in mg/L '''
+        self.node_ids = node_ids
+        self.times = times
+        self.age = age
+        self.chlorine = chlorine
+
+    def save(self, filepath):
+        np.savez_compressed(filepath, node_ids=self.node_ids, times=self.times,
+                            age=self.age, chlorine=self.chlorine)
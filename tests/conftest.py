@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# the app modules import each other by plain name from their own folder
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'pyflow_h2o'))
+
+import hydraulics
+
+
+@pytest.fixture
+def loop_network():
+    ''' reservoir feeding a four node loop, mixing Hazen-Williams and Darcy-Weisbach pipes '''
+    return hydraulics.Network(node_ids=[1, 2, 3, 4, 5],
+                              head=[50, 0, 0, 0, 0],
+                              head_known=[1, 0, 0, 0, 0],
+                              inflow=[0, -0.01, -0.02, -0.015, -0.005],
+                              pipe_ids=[1, 2, 3, 4, 5],
+                              node1=[0, 1, 2, 3, 4],
+                              node2=[1, 2, 3, 4, 1],
+                              length=[500, 400, 300, 400, 350],
+                              diameter=[0.3, 0.2, 0.15, 0.2, 0.15],
+                              f=[130, 130, 130, 0.02, 0.02],
+                              n_exp=[1.852, 1.852, 1.852, 2, 2])
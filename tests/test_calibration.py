@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import calibration
+
+GROUPS = ['hazen', 'hazen', 'hazen', 'darcy', 'darcy']
+
+
+def observe(network, f):
+    ''' pressure heads at the unknown nodes for friction values f '''
+    solution = network.solve(r=network.resistance(f=f), tol=1e-12)
+    return {node_id: head for node_id, head in zip(network.node_ids[network.unknown_nodes].tolist(),
+                                                   solution.head[network.unknown_nodes].tolist())}
+
+
+def test_recovers_group_multipliers(loop_network):
+    multipliers = np.array([0.8, 0.8, 0.8, 1.5, 1.5])
+    observations = observe(loop_network, loop_network.f * multipliers)
+
+    calibrator = calibration.Calibration(loop_network, observations, GROUPS)
+    f, rms_before, rms_after = calibrator.run()
+
+    assert rms_before > 0.1
+    assert rms_after < 1e-4
+    assert np.allclose(f / loop_network.f, multipliers, rtol=1e-3)
+
+
+def test_jacobian_matches_finite_differences(loop_network):
+    calibrator = calibration.Calibration(loop_network, observe(loop_network, loop_network.f), GROUPS)
+    t = np.array([0.1, -0.2])
+
+    def heads(t):
+        f = loop_network.f * np.exp(calibrator.group @ t)
+        solution = loop_network.solve(r=loop_network.resistance(f=f), tol=1e-12)
+        return solution.head[loop_network.unknown_nodes][calibrator.rows], solution, f
+
+    _, solution, f = heads(t)
+    J = calibrator.jacobian(solution, f)
+
+    eps = 1e-5
+    fd = np.column_stack([(heads(t + eps * e)[0] - heads(t - eps * e)[0]) / (2 * eps)
+                          for e in np.eye(len(t))])
+    assert np.allclose(J, fd, rtol=1e-5, atol=1e-8)
+
+
+def test_read_observations(tmp_path):
+    filepath = tmp_path / 'observations.csv'
+    filepath.write_text('node,pressure\n2,41.5\n3,\nnot a node,12\n4,38.25\n\n')
+    assert calibration.read_observations(filepath) == {2: 41.5, 4: 38.25}
+
+
+def test_unknown_observed_node_rejected(loop_network):
+    with pytest.raises(ValueError):
+        calibration.Calibration(loop_network, {99: 40.0}, GROUPS)
@@ -0,0 +1,86 @@
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import design
+
+CATALOGUE = [
+            (100, 0.108, 60.0),
+            (150, 0.155, 85.0),
+            (200, 0.204, 115.0),
+            (300, 0.300, 190.0)
+            ]
+
+
+def cheapest_feasible(network, min_pressure):
+    ''' brute force over every design in the catalogue '''
+    diameters = np.array([size[1] for size in CATALOGUE])
+    costs = np.array([size[2] for size in CATALOGUE])
+    best = None
+    for sizes in itertools.product(range(len(CATALOGUE)), repeat=len(network.pipe_ids)):
+        sizes = np.array(sizes)
+        solution = network.solve(r=network.resistance(diameter=diameters[sizes]))
+        if solution.head[network.unknown_nodes].min() >= min_pressure:
+            cost = (costs[sizes] * network.length).sum()
+            best = cost if best is None else min(best, cost)
+    return best
+
+
+def test_optimizer_finds_cheapest_feasible_design(loop_network):
+    optimizer = design.Optimizer(loop_network, 40.0, catalogue=CATALOGUE, workers=2, seed=1)
+    designs = optimizer.run(population=20, generations=20)
+
+    violation, cost, sizes = designs[0]
+    assert violation == 0
+    assert cost == cheapest_feasible(loop_network, 40.0)
+
+    # the design really is feasible
+    diameters = np.array([CATALOGUE[size][1] for size in sizes])
+    solution = loop_network.solve(r=loop_network.resistance(diameter=diameters))
+    assert solution.head[loop_network.unknown_nodes].min() >= 40.0
+
+
+def test_optimizer_cancel(loop_network):
+    optimizer = design.Optimizer(loop_network, 40.0, catalogue=CATALOGUE, workers=2, seed=1)
+    optimizer.cancel()
+    assert optimizer.run(population=20, generations=20) is None
+
+
+def test_evaluate_retries_failed_warm_start(loop_network, monkeypatch):
+    diameters = np.array([size[1] for size in CATALOGUE])
+    design._init_worker(loop_network, diameters, 40.0)
+    monkeypatch.setattr(design, '_warm_flow', np.full(len(loop_network.pipe_ids), np.nan))
+
+    violation = design._evaluate((3, 3, 3, 3, 3))
+    assert violation == 0
+    assert np.isfinite(design._warm_flow).all()
+
+
+def test_refine_rounds_capped(loop_network):
+    optimizer = design.Optimizer(loop_network, 40.0, catalogue=CATALOGUE, workers=1)
+    optimizer.pool = multiprocessing.Pool(1, initializer=design._init_worker,
+                                          initargs=(loop_network, optimizer.diameters, 40.0))
+    try:
+        largest = (len(CATALOGUE) - 1,) * len(loop_network.pipe_ids)
+        optimizer.evaluate([largest])
+        sizes = optimizer.refine(largest, rounds=2)
+    finally:
+        optimizer.pool.terminate()
+        optimizer.pool.join()
+
+    # two rounds step down at most two pipes, and the design stays feasible
+    assert sum(largest) - sum(sizes) == 2
+    assert optimizer.cache[sizes][0] == 0
+
+
+def test_optimizer_cancel_between_generations(loop_network):
+    optimizer = design.Optimizer(loop_network, 40.0, catalogue=CATALOGUE, workers=2, seed=1)
+    generations = []
+
+    def progress(generation, best):
+        generations.append(generation)
+        optimizer.cancel()
+
+    assert optimizer.run(population=20, generations=20, progress=progress) is None
+    assert generations == [0]
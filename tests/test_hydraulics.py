@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import hydraulics
+
+
+def head_loss(network, solution):
+    q = solution.flow
+    return network.r * q * np.abs(q) ** (network.n_exp - 1)
+
+
+def test_solve_mass_balance(loop_network):
+    solution = loop_network.solve()
+
+    # pipe flows into each solved node balance its demand
+    balance = loop_network.A21 @ solution.flow + loop_network.inflow[loop_network.unknown_nodes]
+    assert np.abs(balance).max() < 1e-9
+
+    # the reservoir supplies the total demand
+    assert solution.flow[0] == pytest.approx(0.05)
+
+
+def test_solve_head_loss_residuals(loop_network):
+    solution = loop_network.solve()
+
+    drop = solution.head[loop_network.node1] - solution.head[loop_network.node2]
+    assert np.abs(head_loss(loop_network, solution) - drop).max() < 1e-8
+    assert solution.head[0] == 50
+
+
+def test_warm_start(loop_network):
+    cold = loop_network.solve()
+    warm = loop_network.solve(flow=cold.flow * 1.1)
+
+    assert warm.iterations < cold.iterations
+    assert np.allclose(warm.head, cold.head, atol=1e-6)
+
+
+def test_no_known_head(loop_network):
+    with pytest.raises(ValueError):
+        hydraulics.Network(loop_network.node_ids, loop_network.head, [0] * 5, loop_network.inflow,
+                           loop_network.pipe_ids, loop_network.node1, loop_network.node2, loop_network.length,
+                           loop_network.diameter, loop_network.f, loop_network.n_exp)
+
+
+def test_missing_pipe_data(loop_network):
+    with pytest.raises(ValueError, match=r'\[3\]'):
+        hydraulics.Network(loop_network.node_ids, loop_network.head, loop_network.known, loop_network.inflow,
+                           loop_network.pipe_ids, loop_network.node1, loop_network.node2, loop_network.length,
+                           [0.3, 0.2, 0, 0.2, 0.15], loop_network.f, loop_network.n_exp)
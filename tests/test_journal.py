@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+import main
+
+
+class Parent:
+    ''' stands in for the app window, the model only asks it to redraw during backups '''
+    def update_idletasks(self):
+        pass
+
+
+@pytest.fixture
+def model(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'recovery_dir', str(tmp_path))
+    return main.Model(Parent(), None)
+
+
+def node(node_id, x=0.0, y=0.0):
+    return (node_id, f'node {node_id}', None, None, None, None, None, None, 50.0, 1, -0.01, 1, x, y)
+
+
+def nodes(model):
+    return model.db.execute('SELECT * FROM nodes ORDER BY id').fetchall()
+
+
+def test_undo_redo_round_trip(model):
+    states = [nodes(model)]
+    for step in (lambda: model.insert_row('nodes', node(1)),
+                 lambda: model.insert_row('nodes', node(2)),
+                 lambda: model.update_rows('nodes', {1: {'x': 10.0, 'y': 20.0}, 2: {'inflow': -0.5}}),
+                 lambda: model.delete_row('nodes', 2)):
+        step()
+        states.append(nodes(model))
+
+    for state in reversed(states[:-1]):
+        assert model.undo()
+        assert nodes(model) == state
+    assert model.undo() == []
+
+    for state in states[1:]:
+        assert model.redo()
+        assert nodes(model) == state
+    assert model.redo() == []
+
+
+def test_recover_replays_journal_on_autosave(model):
+    model.insert_row('nodes', node(1))
+    model.insert_row('nodes', node(2))
+    assert model.start_autosave()
+    model.finish_autosave()
+    assert not os.path.exists(model.journal.prev_path())
+
+    # undo an edit the autosave already holds, then carry on editing
+    model.undo()
+    model.update_rows('nodes', {1: {'x': 5.0}})
+    model.insert_row('nodes', node(3))
+    model.undo()
+    model.journal.close()
+
+    # a crash leaves the files behind, the next session in this process picks them up
+    recovered = main.Model(Parent(), None)
+    assert recovered.has_recovery()
+    recovered.recover()
+    assert nodes(recovered) == nodes(model)
+
+    # the undone edits can still be redone after recovery
+    recovered.redo()
+    assert [row[0] for row in nodes(recovered)] == [1, 3]
+    recovered.journal.close()
+
+
+def test_failed_autosave_keeps_journal(model, monkeypatch):
+    def fail(filepath, redraw=True):
+        raise OSError('disk full')
+
+    model.insert_row('nodes', node(1))
+    monkeypatch.setattr(model, 'backup_to', fail)
+    assert model.start_autosave()
+    with pytest.raises(OSError):
+        model.finish_autosave()
+    assert os.path.exists(model.journal.prev_path())
+
+    # a second failure merges the new entries into .prev after the old ones
+    model.update_rows('nodes', {1: {'x': 5.0}})
+    assert model.start_autosave()
+    with pytest.raises(OSError):
+        model.finish_autosave()
+    model.insert_row('nodes', node(2))
+    model.journal.close()
+
+    recovered = main.Model(Parent(), None)
+    recovered.recover()
+    assert nodes(recovered) == nodes(model)
+    recovered.journal.close()
+
+    # the next autosave that succeeds drops .prev
+    monkeypatch.delattr(model, 'backup_to')
+    assert model.start_autosave()
+    model.finish_autosave()
+    assert not os.path.exists(model.journal.prev_path())
+    assert os.path.exists(model.autosave_path)
+
+
+def test_edit_rolled_back_when_journal_fails(model, monkeypatch):
+    model.insert_row('nodes', node(1))
+
+    def fail(op, deltas):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(model.journal, 'log', fail)
+    with pytest.raises(OSError):
+        model.insert_row('nodes', node(2))
+    with pytest.raises(OSError):
+        model.update_rows('nodes', {1: {'x': 5.0}})
+    with pytest.raises(OSError):
+        model.undo()
+
+    assert nodes(model) == [node(1)]
+    assert len(model.journal.undo_stack) == 1
+    assert model.journal.redo_stack == []
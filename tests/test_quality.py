@@ -0,0 +1,114 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+import hydraulics
+import quality
+
+DECAY = 0.5 # 1/day
+
+
+def network(head_known, inflow, node1, node2, length):
+    n_nodes, n_pipes = len(inflow), len(node1)
+    return hydraulics.Network(node_ids=np.arange(1, n_nodes + 1),
+                              head=np.where(head_known, 50, 0),
+                              head_known=head_known,
+                              inflow=inflow,
+                              pipe_ids=np.arange(1, n_pipes + 1),
+                              node1=node1,
+                              node2=node2,
+                              length=length,
+                              diameter=[0.1] * n_pipes,
+                              f=[130] * n_pipes,
+                              n_exp=[1.852] * n_pipes)
+
+
+def chlorine(seconds):
+    return np.exp(-DECAY * seconds / quality.SECONDS_PER_DAY)
+
+
+def test_chain_age_and_chlorine():
+    # reservoir -> 2 -> 3, 600 s and 600 s of travel
+    chain = network(head_known=[1, 0, 0], inflow=[0, 0, -0.01], node1=[0, 1], node2=[1, 2], length=[600, 300])
+    transport = quality.Transport(chain, flow=[0.01, 0.01], velocity=[1.0, 0.5], dt=60, duration=7200,
+                                  decay=DECAY)
+    results = transport.run()
+
+    travel = np.array([0, 600, 1200])
+    assert np.allclose(results.age[-1] * 3600, travel)
+    assert np.allclose(results.chlorine[-1], chlorine(travel), rtol=1e-6)
+    assert np.allclose(results.times, np.arange(3) * 3600)
+
+
+def test_junction_mixes_by_flow():
+    # reservoir and an inflow node meet at node 3, which feeds node 4 through a pipe with no cells
+    junction = network(head_known=[1, 0, 0, 0], inflow=[0, 0.02, 0, -0.03],
+                       node1=[0, 1, 2], node2=[2, 2, 3], length=[600, 1200, 10])
+    transport = quality.Transport(junction, flow=[0.01, 0.02, 0.03], velocity=[1.0, 1.0, 1.0], dt=60,
+                                  duration=7200, decay=DECAY)
+    assert len(transport.direct) == 1
+    results = transport.run()
+
+    age = (0.01 * 600 + 0.02 * 1200) / 0.03
+    cl = (0.01 * chlorine(600) + 0.02 * chlorine(1200)) / 0.03
+    assert np.allclose(results.age[-1] * 3600, [0, 0, age, age])
+    assert np.allclose(results.chlorine[-1], [1, 1, cl, cl], rtol=1e-6)
+
+
+def test_stagnant_node_ages():
+    # node 3 hangs off a pipe without flow
+    stagnant = network(head_known=[1, 0, 0], inflow=[0, -0.01, 0], node1=[0, 1], node2=[1, 2], length=[600, 300])
+    transport = quality.Transport(stagnant, flow=[0.01, 0.0], velocity=[1.0, 0.0], dt=60, duration=7200,
+                                  decay=DECAY)
+    results = transport.run(initial=(0.0, 1.0))
+
+    assert np.allclose(results.age[:, 2] * 3600, results.times)
+    assert np.allclose(results.chlorine[:, 2], chlorine(results.times), rtol=1e-6)
+
+
+def test_short_pipe_loop_rejected():
+    # flow circulates 2 -> 3 -> 4 -> 2 through pipes that carry no cells
+    loop = network(head_known=[1, 0, 0, 0], inflow=[0, 0, 0, -0.01],
+                   node1=[0, 1, 2, 3], node2=[1, 2, 3, 1], length=[600, 10, 10, 10])
+    with pytest.raises(ValueError):
+        quality.Transport(loop, flow=[0.01, 0.02, 0.02, 0.01], velocity=[1.0] * 4, dt=60)
+
+
+@pytest.fixture
+def solved_db(loop_network):
+    ''' model tables holding the loop network and its solved flows '''
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE nodes (id integer PRIMARY KEY, head real, head_known integer, inflow real, '
+               'pressure real)')
+    db.execute('CREATE TABLE pipes (id integer PRIMARY KEY, node1 integer, node2 integer, length real, '
+               'internal_diameter real, f real, n_exp real, flow real, flow_direction integer, v real, Re real)')
+    n = loop_network
+    db.executemany('INSERT INTO nodes (id, head, head_known, inflow) VALUES (?, ?, ?, ?)',
+                   zip(n.node_ids.tolist(), n.head.tolist(), n.known.astype(int).tolist(), n.inflow.tolist()))
+    db.executemany('INSERT INTO pipes (id, node1, node2, length, internal_diameter, f, n_exp) '
+                   'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   zip(n.pipe_ids.tolist(), n.node_ids[n.node1].tolist(), n.node_ids[n.node2].tolist(),
+                       n.length.tolist(), n.diameter.tolist(), n.f.tolist(), n.n_exp.tolist()))
+    hydraulics.write_results(db, n, n.solve())
+    yield db
+    db.close()
+
+
+def test_from_db(solved_db):
+    results = quality.Transport.from_db(solved_db, duration=48 * 3600).run()
+    assert (results.age[-1] >= 0).all()
+    assert (results.chlorine[-1] <= 1).all()
+    assert results.age[-1][0] == 0 # the reservoir
+
+
+def test_from_db_rejects_unsolved_flows(solved_db):
+    solved_db.execute('UPDATE pipes SET flow = NULL WHERE id = 2')
+    with pytest.raises(ValueError):
+        quality.Transport.from_db(solved_db)
+
+
+def test_from_db_rejects_unbalanced_flows(solved_db):
+    solved_db.execute('UPDATE pipes SET flow = 2 * flow WHERE id = 2')
+    with pytest.raises(ValueError):
+        quality.Transport.from_db(solved_db)